@@ -1,44 +1,28 @@
 import streamlit as st
-import fitz
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import os
 import json
-from typing import List, Dict
-from openai import OpenAI
+import hashlib
+import asyncio
+import threading
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
+from openai import AsyncOpenAI
+from pydantic import BaseModel
 from io import BytesIO
 
-class ResumeParser:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
-        
-    def extract_text_from_file(self, file) -> str:
-        try:
-            # Read the file into bytes
-            file_bytes = file.read()
-            
-            # Open document with PyMuPDF
-            doc = fitz.open(stream=file_bytes, filetype="docx" if file.name.endswith((".docx", ".doc")) else "pdf")
-            
-            # Extract text from all pages
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            
-            # Close the document
-            doc.close()
-            return text
-        except Exception as e:
-            st.error(f"Error extracting text from file: {str(e)}")
-            return ""
+PROMPT_VERSION = "v2"
+MODEL = "gpt-4o-mini"
+CACHE_DIR = os.path.join("data", "llm_cache")
+BATCH_SIZE = 4  # resumes per OpenAI request
+MAX_CONCURRENT_REQUESTS = 8  # OpenAI requests in flight at once
+MAX_PROMPT_CHARS = 12000  # roughly 3k tokens of resume text
+MIN_TEXT_CHARS = 100  # below this there is nothing worth sending to the model
+MIN_CHARS_PER_PAGE = 50  # below this a PDF is most likely scanned images
 
-    def extract_text(self, file) -> str:
-        if file.name.lower().endswith(('.pdf', '.docx', '.doc')):
-            return self.extract_text_from_file(file)
-        else:
-            st.error("Unsupported file format. Please upload PDF or DOCX files only.")
-            return ""
-
-    def extract_information(self, text: str) -> Dict:
-        prompt = f"""Extract the following structured information from the resume text. Ensure consistency in format and field names. If data is not exist in resume, leave it empty. Return the data in JSON format:
+_RESUME_FIELDS = """\
         - name: Full name of the candidate (string)
         - education: List of educational qualifications (list of dictionaries)
           Each dictionary contains:
@@ -58,98 +42,386 @@ class ResumeParser:
             - job_description: All of job responsibilities (string)
         - certificates: List of valid certificates (list of strings)
         - visas: List of valid work visas (list of strings)
-        - summary: AI-generated summary of the candidate's profile (2-3 sentences, string)
+        - summary: AI-generated summary of the candidate's profile (2-3 sentences, string)"""
+
+# Static prompt prefixes; bump PROMPT_VERSION whenever these change so cached results are invalidated
+_PROMPT_HEAD = """Extract the following structured information from the resume text. Ensure consistency in format and field names. If data is not exist in resume, leave it empty. Return the data in JSON format:
+""" + _RESUME_FIELDS + """
         
         Resume text:
-        {text}
-        """
+"""
+
+_BATCH_PROMPT_HEAD = """Extract the following structured information from each of the resumes below. Ensure consistency in format and field names. If data is not exist in a resume, leave it empty. Return a JSON object {"results": [...]} with exactly one object per resume, in the same order as the resumes appear:
+""" + _RESUME_FIELDS + """
+        
+        Resumes:
+"""
+
+class Education(BaseModel):
+    institution: str
+    location: str
+    degree: str
+    date: str
+
+class Experience(BaseModel):
+    company_name: str
+    position: str
+    duration: str
+    job_description: str
+
+class Resume(BaseModel):
+    name: str
+    education: List[Education]
+    nationality: str
+    dob: str
+    languages: List[str]
+    location: str
+    experience: List[Experience]
+    certificates: List[str]
+    visas: List[str]
+    summary: str
+
+class ResumeBatch(BaseModel):
+    results: List[Resume]
+
+def _clip(text: str, max_chars: int = MAX_PROMPT_CHARS) -> str:
+    """
+    Bound the resume text sent to the model, keeping the head and tail and dropping the middle.
+    """
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars * 2 // 3] + "\n...[truncated]...\n" + text[-(max_chars // 3):]
+
+def _has_enough_text(text: str, name: str) -> bool:
+    text_chars = len(text.strip())
+    if text_chars < MIN_TEXT_CHARS:
+        st.warning(f"{name}: resume text too short ({text_chars} chars); skipping LLM.")
+        return False
+    return True
+
+def _file_bytes(file) -> bytes:
+    """
+    Return the upload's contents, using UploadedFile.getvalue() so the stream position is untouched.
+    """
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    data = file.read()
+    file.seek(0)
+    return data
+
+class ResumeCache:
+    """
+    Content-addressable disk cache for extracted resume information.
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def make_key(file_bytes: bytes) -> str:
+        return hashlib.sha256(
+            PROMPT_VERSION.encode() + b"\0" + MODEL.encode() + b"\0" + file_bytes
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)["data"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, info: Dict):
+        entry = {
+            "cachedAt": datetime.now(timezone.utc).isoformat(),
+            "modelId": MODEL,
+            "promptVersion": PROMPT_VERSION,
+            "data": info,
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._path(key) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            st.warning(f"Could not write cache entry: {str(e)}")
+
+class ResumeParser:
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    def open_client(self) -> AsyncOpenAI:
+        """
+        Create an async OpenAI client for one processing run. Its connections are bound to the
+        event loop that opened them, so the client is not shared across reruns.
+        """
+        return AsyncOpenAI(api_key=self.api_key)
+
+    async def _parse(self, client: AsyncOpenAI, limit: asyncio.Semaphore, prompt: str, response_format):
+        # Cap concurrent requests, including per-resume retries after a failed batch
+        async with limit:
+            return await client.beta.chat.completions.parse(
+                model=MODEL,
                 messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"}
+                response_format=response_format
             )
-            return json.loads(response.choices[0].message.content)
+        
+    def extract_text_from_file(self, name: str, data: bytes) -> str:
+        try:
+            # Route by extension
+            if name.lower().endswith(".pdf"):
+                return self._extract_pdf_bytes(name, data)
+            return self._extract_docx_bytes(data)
+        except Exception as e:
+            st.error(f"Error extracting text from {name}: {str(e)}")
+            return ""
+
+    def _extract_pdf_bytes(self, name: str, file_bytes: bytes) -> str:
+        # Imported here so the app starts without loading MuPDF until a PDF is uploaded
+        import fitz
+        # Open document with PyMuPDF; closing() releases it even if a page fails
+        with closing(fitz.open(stream=file_bytes, filetype="pdf")) as doc:
+            # Load pages one at a time so no page objects outlive their text; TEXTFLAGS_TEXT is the
+            # default set and already includes TEXT_PRESERVE_WHITESPACE
+            page_count = doc.page_count
+            text = "".join([
+                doc.load_page(i).get_text("text", sort=False, flags=fitz.TEXTFLAGS_TEXT) for i in range(page_count)
+            ])
+        if page_count and len(text.strip()) / page_count < MIN_CHARS_PER_PAGE:
+            # Likely a scan: returning no text skips the file instead of sending OCR-less pages to OpenAI
+            st.warning(f"{name}: very little text found in this PDF; it may be a scanned document that needs OCR. Skipping.")
+            return ""
+        return text
+
+    def _extract_docx_bytes(self, file_bytes: bytes) -> str:
+        from docx import Document
+        document = Document(BytesIO(file_bytes))
+        return "\n".join(p.text for p in document.paragraphs)
+
+    def extract_text(self, name: str, data: bytes) -> str:
+        if name.lower().endswith(('.pdf', '.docx')):
+            return self.extract_text_from_file(name, data)
+        else:
+            st.error(f"{name}: unsupported file format. Please upload PDF or DOCX files only (convert legacy .doc files to DOCX).")
+            return ""
+
+    async def extract_information(self, client: AsyncOpenAI, limit: asyncio.Semaphore, name: str, text: str) -> Dict:
+        if not _has_enough_text(text, name):
+            return {}
+        text = _clip(text)
+        prompt = _PROMPT_HEAD + text
+        try:
+            response = await self._parse(client, limit, prompt, Resume)
+            parsed = response.choices[0].message.parsed
+            return parsed.model_dump() if parsed else {}
         except Exception as e:
-            st.error(f"Error extracting information: {str(e)}")
+            st.error(f"Error extracting information from {name}: {str(e)}")
             return {}
 
-def display_formatted_resume(info: Dict, filename: str):
+    async def extract_information_batch(self, client: AsyncOpenAI, limit: asyncio.Semaphore,
+                                        texts: List[Tuple[str, str, str]]) -> Dict[str, Dict]:
+        """
+        Extract information for several (resume id, filename, text) entries in a single request.
+        Falls back to one request per resume if the batched response does not line up.
+        Every request waits on `limit`, which bounds how many are in flight at once.
+        """
+        if len(texts) == 1:
+            resume_id, name, text = texts[0]
+            return {resume_id: await self.extract_information(client, limit, name, text)}
+        
+        blocks = "".join(
+            f"\n--- BEGIN RESUME {resume_id} ---\n{_clip(text)}\n--- END RESUME ---\n"
+            for resume_id, _, text in texts
+        )
+        prompt = _BATCH_PROMPT_HEAD + blocks
+        try:
+            response = await self._parse(client, limit, prompt, ResumeBatch)
+            parsed = response.choices[0].message.parsed
+            if parsed and len(parsed.results) == len(texts):
+                return {resume_id: info.model_dump() for (resume_id, _, _), info in zip(texts, parsed.results)}
+        except Exception as e:
+            st.warning(f"Batched extraction failed, retrying per resume: {str(e)}")
+        infos = await asyncio.gather(*[self.extract_information(client, limit, name, text) for _, name, text in texts])
+        return {resume_id: info for (resume_id, _, _), info in zip(texts, infos)}
+
+@st.cache_data(show_spinner=False)
+def _render_markdown(info_json: str, filename: str) -> Tuple[str, List[Tuple[str, str]], str]:
     """
-    Display resume information in a formatted, readable manner using Streamlit components.
+    Build the Markdown for a resume. Cached on the serialized info so reruns skip the assembly.
+    Returns the sections before the work experience, one (title, body) pair per role, and the
+    sections after it.
     """
-    # Clear previous content
-    st.empty()
+    info = json.loads(info_json)
+    lines: List[str] = []
     
     # Display file name as title
-    st.title(f"Resume Analysis: {filename}")
+    lines.append(f"# Resume Analysis: {filename}")
     
     # Display basic information
-    st.subheader("📌 Basic Information")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.write(f"**Name:** {info.get('name', 'N/A')}")
-        st.write(f"**Location:** {info.get('location', 'N/A')}")
-    with col2:
-        st.write(f"**Nationality:** {info.get('nationality', 'N/A')}")
-        st.write(f"**Date of Birth:** {info.get('dob', 'N/A')}")
+    lines.append("### 📌 Basic Information")
+    lines.append(f"**Name:** {info.get('name', 'N/A')}  ")
+    lines.append(f"**Location:** {info.get('location', 'N/A')}  ")
+    lines.append(f"**Nationality:** {info.get('nationality', 'N/A')}  ")
+    lines.append(f"**Date of Birth:** {info.get('dob', 'N/A')}")
 
     # Display summary
     if info.get('summary'):
-        st.subheader("📝 Professional Summary")
-        st.write(info['summary'])
+        lines.append("### 📝 Professional Summary")
+        lines.append(info['summary'])
 
-    # Display work experience
+    # Display work experience, one collapsible block per role
+    experience: List[Tuple[str, str]] = []
     if info.get('experience'):
-        st.subheader("💼 Work Experience")
+        lines.append("### 💼 Work Experience")
         for exp in info['experience']:
-            with st.expander(f"{exp.get('position', 'Role')} at {exp.get('company_name', 'Company')}"):
-                st.write(f"**Duration:** {exp.get('duration', 'N/A')}")
-                st.write(f"**Job Description:**")
-                job_desc = exp.get('job_description', '').split('\n')
-                for desc in job_desc:
-                    if desc.strip():
-                        st.write(f"- {desc.strip()}")
+            title = f"{exp.get('position', 'Role')} at {exp.get('company_name', 'Company')}"
+            bullets = "\n".join(f"- {d.strip()}" for d in exp.get('job_description', '').split('\n') if d.strip())
+            experience.append((title, f"**Duration:** {exp.get('duration', 'N/A')}\n\n**Job Description:**\n{bullets}"))
+    head = "\n".join(lines)
+    lines = []
 
     # Display education
     if info.get('education'):
-        st.subheader("🎓 Education")
+        lines.append("### 🎓 Education")
         for edu in info['education']:
-            st.write(f"**{edu.get('degree', 'Degree')}**")
-            st.write(f"- Institution: {edu.get('institution', 'N/A')}")
-            st.write(f"- Location: {edu.get('location', 'N/A')}")
-            st.write(f"- Completion Date: {edu.get('date', 'N/A')}")
+            lines.append(f"**{edu.get('degree', 'Degree')}**\n")
+            lines.append(f"- Institution: {edu.get('institution', 'N/A')}")
+            lines.append(f"- Location: {edu.get('location', 'N/A')}")
+            lines.append(f"- Completion Date: {edu.get('date', 'N/A')}\n")
 
     # Display languages
     if info.get('languages'):
-        st.subheader("🗣 Languages")
-        st.write(", ".join(info['languages']))
+        lines.append("### 🗣 Languages")
+        lines.append(", ".join(info['languages']))
 
     # Display certificates
     if info.get('certificates'):
-        st.subheader("📜 Certificates")
+        lines.append("### 📜 Certificates")
         for cert in info['certificates']:
-            st.write(f"- {cert}")
+            lines.append(f"- {cert}")
 
     # Display visas
     if info.get('visas'):
-        st.subheader("🛂 Work Visas")
+        lines.append("### 🛂 Work Visas")
         for visa in info['visas']:
-            st.write(f"- {visa}")
+            lines.append(f"- {visa}")
 
-def process_uploaded_files(files, parser):
-    if 'extracted_data' not in st.session_state:
-        st.session_state['extracted_data'] = {}
-    
-    new_files = [f for f in files if f.name not in st.session_state['extracted_data']]
+    return head, experience, "\n".join(lines)
+
+def display_formatted_resume(info: Dict, filename: str):
+    """
+    Display resume information in a formatted, readable manner using a few Markdown elements.
+    Raw HTML stays disabled since every value comes from the uploaded file or the model.
+    """
+    head, experience, tail = _render_markdown(json.dumps(info, sort_keys=True), filename)
+    st.markdown(head)
+    for title, body in experience:
+        with st.expander(title):
+            st.markdown(body)
+    if tail:
+        st.markdown(tail)
+
+def _extract_one(content_hash: str, name: str, data: bytes, parser, cache: ResumeCache, use_cache: bool):
+    """
+    Look up and extract text from a single uploaded file. Safe to call from a worker thread.
+    Returns (content hash, cache key, cached info or None, text).
+    """
+    key = ResumeCache.make_key(data)
+    if use_cache:
+        info = cache.get(key)
+        if info:
+            return content_hash, key, info, ""
+    return content_hash, key, None, parser.extract_text(name, data)
+
+async def _process_new_files(new_files: Dict[str, List[str]], contents: Dict[str, bytes], parser,
+                             cache: ResumeCache, use_cache: bool, store, skip, status):
+    # Text extraction and cache lookups run on the loop's executor threads
+    results = await asyncio.gather(*[
+        asyncio.to_thread(_extract_one, h, names[0], contents[h], parser, cache, use_cache)
+        for h, names in new_files.items()
+    ])
+    pending = []
+    keys = {}
+    for h, key, info, text in results:
+        if info:
+            store(h, info)
+        elif text and _has_enough_text(text, new_files[h][0]):
+            pending.append((h, new_files[h][0], text))
+            keys[h] = key
+        else:
+            skip(h)
     
-    for file in new_files:
-        with st.spinner(f"Processing {file.name}..."):
-            text = parser.extract_text(file)
-            if text:
-                info = parser.extract_information(text)
+    # Cache misses go to OpenAI in batches, at most MAX_CONCURRENT_REQUESTS in flight
+    if not pending:
+        return
+    batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+    done = len(new_files) - len(pending)
+    limit = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    async with parser.open_client() as client:
+        for next_batch in asyncio.as_completed([parser.extract_information_batch(client, limit, b) for b in batches]):
+            for h, info in (await next_batch).items():
+                done += 1
                 if info:
-                    st.session_state['extracted_data'][file.name] = info
+                    cache.put(keys[h], info)
+                    store(h, info)
+                status.update(label=f"Processed {new_files[h][0]} ({done}/{len(new_files)})")
+
+def process_uploaded_files(files, parser, use_cache: bool = True):
+    if 'hash_to_info' not in st.session_state:
+        st.session_state['hash_to_info'] = {}
+    if 'name_to_hash' not in st.session_state:
+        st.session_state['name_to_hash'] = {}
+    if 'skipped_hashes' not in st.session_state:
+        st.session_state['skipped_hashes'] = set()
+    hash_to_info = st.session_state['hash_to_info']
+    name_to_hash = st.session_state['name_to_hash']
+    skipped_hashes = st.session_state['skipped_hashes']
+    
+    # Read each upload once and deduplicate on its content within the session, so the same resume
+    # under another name is not re-extracted; results from earlier sessions come from the versioned
+    # ResumeCache, looked up per file. The bytes are passed through the rest of the pipeline
+    new_files: Dict[str, List[str]] = {}
+    contents: Dict[str, bytes] = {}
+    for f in files:
+        data = _file_bytes(f)
+        h = hashlib.sha256(data).hexdigest()
+        if h in hash_to_info:
+            name_to_hash[f.name] = h
+        elif h in skipped_hashes:
+            # No usable text last time; don't re-extract and re-warn on every rerun
+            continue
+        else:
+            new_files.setdefault(h, []).append(f.name)
+            contents[h] = data
+    if not new_files:
+        return
+    cache = ResumeCache()
+    
+    def store(h: str, info: Dict):
+        hash_to_info[h] = info
+        for name in new_files[h]:
+            name_to_hash[name] = h
+    
+    def skip(h: str):
+        skipped_hashes.add(h)
+    
+    # Attach the script run context to executor threads so st.error/st.warning still reach the page
+    ctx = get_script_run_ctx()
+    def attach_ctx():
+        add_script_run_ctx(threading.current_thread(), ctx)
+    
+    # The event loop runs on the script thread, so Streamlit calls from coroutines behave as usual
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=min(8, len(new_files)), initializer=attach_ctx))
+    with st.status(f"Processing {len(new_files)} resume(s)...") as status:
+        try:
+            loop.run_until_complete(_process_new_files(new_files, contents, parser, cache, use_cache, store, skip, status))
+        finally:
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+        status.update(label=f"Processed {len(new_files)} resume(s)", state="complete")
 
 def main():
     st.set_page_config(layout="wide")
@@ -166,15 +438,16 @@ def main():
             st.warning("Please enter your OpenAI API key to continue.")
             return
             
-        uploaded_files = st.file_uploader("Upload Resumes (PDF, DOC, DOCX)", type=['pdf', 'doc', 'docx'], accept_multiple_files=True)
+        uploaded_files = st.file_uploader("Upload Resumes (PDF, DOCX)", type=['pdf', 'docx'], accept_multiple_files=True)
+        no_cache = st.checkbox("Disable cache (always call OpenAI)", value=False)
         
         if uploaded_files:
             parser = ResumeParser(api_key)
-            process_uploaded_files(uploaded_files, parser)
+            process_uploaded_files(uploaded_files, parser, use_cache=not no_cache)
     
     # Main content area
-    if 'extracted_data' in st.session_state and st.session_state['extracted_data']:
-        resumes = list(st.session_state['extracted_data'].keys())
+    if st.session_state.get('name_to_hash'):
+        resumes = list(st.session_state['name_to_hash'].keys())
         
         # Create selectbox for resume selection
         selected_resume = st.selectbox(
@@ -185,7 +458,7 @@ def main():
         
         # Display the selected resume
         if selected_resume:
-            extracted_info = st.session_state['extracted_data'][selected_resume]
+            extracted_info = st.session_state['hash_to_info'][st.session_state['name_to_hash'][selected_resume]]
             display_formatted_resume(extracted_info, selected_resume)
     else:
         st.write("Upload resumes in the sidebar to begin analysis.")